@@ -46,6 +46,7 @@ install_requires = [
     'Brotli>=1.0.9',
     'matplotlib>=3.5.2,<4',
     'paramiko>=2.11.0,<4',
+    'posix_ipc>=1.0.5,<2',
     'python-snappy>=0.6.1,<1',
     'torch>=1.10,<2',
     'torchtext>=0.10',
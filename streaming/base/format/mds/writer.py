@@ -86,8 +86,7 @@ class MDSWriter(JointWriter):
                     )
             data.append(datum)
         head = np.array(sizes, np.uint32).tobytes()
-        body = b''.join(data)
-        return head + body
+        return b''.join([head] + data)
 
     def get_config(self) -> Dict[str, Any]:
         """Get object describing shard-writing configuration.
@@ -113,5 +112,7 @@ class MDSWriter(JointWriter):
         sizes = list(map(len, self.new_samples))
         offsets = np.array([0] + sizes).cumsum().astype(np.uint32)
         offsets += len(num_samples.tobytes()) + len(offsets.tobytes()) + len(self.config_data)
-        sample_data = b''.join(self.new_samples)
-        return num_samples.tobytes() + offsets.tobytes() + self.config_data + sample_data
+        # Join header and samples in one pass rather than materializing the concatenated sample
+        # data first and copying it again, which would hold two copies of the shard in memory.
+        return b''.join([num_samples.tobytes(), offsets.tobytes(), self.config_data] +
+                        self.new_samples)
@@ -11,14 +11,23 @@ import os
 import shutil
 from multiprocessing.shared_memory import SharedMemory
 from time import sleep
-from typing import Optional
+from typing import Callable, Optional
 
 import numpy as np
 from filelock import FileLock
 
+try:
+    import posix_ipc
+except ImportError:
+    posix_ipc = None
+
 # Time to wait, in seconds.
 TICK = 0.07
 
+# Number of times to re-check a wait condition before starting to sleep between checks, absorbing
+# short waits without paying a TICK of wakeup latency.
+SPIN = 100
+
 # Time out to wait before raising exception
 TIMEOUT = 60
 
@@ -30,6 +39,10 @@ class SharedBarrier:
     is called. This is because the object is created in a per-rank process, and called by worker
     processes.
 
+    Waiters block on named semaphores when ``posix_ipc`` is available, so waking is done by the
+    kernel instead of by polling shared memory with ``sleep(TICK)``. When it is not available, we
+    fall back to the polling loops.
+
     Args:
         filelock_path (str): Path to lock file on local filesystem.
         shm_path (str): Shared memory object name in /dev/shm.
@@ -40,43 +53,106 @@ class SharedBarrier:
         self.is_local_leader = is_local_leader
         self.filelock_path = filelock_path
         self.shm_path = shm_path
+        self._pid = os.getpid()
 
-        # Create three int32 fields in shared memory: num_enter, num_exit, flag.
-        size = 3 * np.int32(0).nbytes
-
-        try:
-            # Creates a new shared memory block
-            self._shm = SharedMemory(shm_path, True, size)
-        except FileExistsError:
-            sleep(TICK)
-            # Attaches to an existing shared memory block
-            self._shm = SharedMemory(shm_path, False, size)
+        # Create four int32 fields in shared memory: num_enter, num_exit, flag, num_attached.
+        size = 4 * np.int32(0).nbytes
 
         # Create filelock.
         self.dirname = os.path.dirname(filelock_path)
         os.makedirs(self.dirname, exist_ok=True)
         self.lock = FileLock(filelock_path)
 
-        self._arr = np.ndarray(3, buffer=self._shm.buf, dtype=np.int32)
-        self._arr[0] = 0
-        self._arr[1] = -1
-        self._arr[2] = True
+        # Create or attach the shared memory block, and take a reference to it, under the lock so
+        # that the creator's initialization cannot race an attacher.
+        with self.lock:
+            try:
+                # Creates a new shared memory block
+                self._shm = SharedMemory(shm_path, True, size)
+                self._arr = np.ndarray(4, buffer=self._shm.buf, dtype=np.int32)
+                self._arr[0] = 0
+                self._arr[1] = -1
+                self._arr[2] = True
+                self._arr[3] = 0
+            except FileExistsError:
+                # Attaches to an existing shared memory block
+                self._shm = SharedMemory(shm_path, False, size)
+                self._arr = np.ndarray(4, buffer=self._shm.buf, dtype=np.int32)
+            self._arr[3] += 1
+
+    def __getstate__(self) -> dict:
+        """Get state for pickling, dropping the per-process semaphore handles.
+
+        Returns:
+            dict: The picklable state.
+        """
+        state = self.__dict__.copy()
+        state.pop('_sems', None)
+        return state
+
+    def _wait_for(self, predicate: Callable[[], bool]) -> None:
+        """Wait for a condition on the shared array when semaphores are unavailable.
+
+        Spins briefly to absorb short waits, then falls back to sleeping a TICK between checks.
+
+        Args:
+            predicate (Callable[[], bool]): The wait condition.
+        """
+        for _ in range(SPIN):
+            if predicate():
+                return
+        while not predicate():
+            sleep(TICK)
+
+    def _get_sem(self, suffix: str):
+        """Get (creating or attaching as needed) one of our named semaphores.
+
+        Semaphore handles are cached per process, as they cannot be shared across processes or
+        pickled.
+
+        Args:
+            suffix (str): Which semaphore ("go" or "exit").
+
+        Returns:
+            posix_ipc.Semaphore: The semaphore.
+        """
+        sems = self.__dict__.setdefault('_sems', {})
+        if suffix not in sems:
+            name = f'/{self.shm_path}_{suffix}'
+            sems[suffix] = posix_ipc.Semaphore(name, posix_ipc.O_CREAT, initial_value=0)
+        return sems[suffix]
 
     def __del__(self):
-        """Destructor clears array that references shm."""
-        if hasattr(self, '_shm') and self._shm is not None:
-            # Close each SharedMemory instance
-            self._shm.close()
-            if self.is_local_leader:
-                # Call unlink only once to release the shared memory
-                self._shm.unlink()
-            else:
-                # Wait for local leader process to execute first
-                sleep(1)
-        if hasattr(self, 'dirname') and self.is_local_leader:
+        """Destructor drops our reference to the shm, the last process out unlinking it."""
+        if not hasattr(self, '_shm') or self._shm is None:
+            return
+
+        # Drop our reference, if we took one. Instances arriving in a process via fork or pickle
+        # share their creator's reference, so they just close. The process whose decrement hits
+        # zero owns deletion, deterministically.
+        is_last = False
+        if getattr(self, '_pid', None) == os.getpid():
+            try:
+                with FileLock(self.filelock_path):
+                    self._arr[3] -= 1
+                    is_last = not self._arr[3]
+            except OSError:
+                pass
+
+        # Close each SharedMemory instance
+        self._shm.close()
+        if is_last:
+            # Call unlink only once to release the shared memory
+            self._shm.unlink()
+            if posix_ipc:
+                for suffix in ('go', 'exit'):
+                    try:
+                        self._get_sem(suffix).unlink()
+                    except posix_ipc.ExistentialError:
+                        pass
             if os.path.islink(self.dirname):
                 os.unlink(self.dirname)
-            shutil.rmtree(self.dirname)
+            shutil.rmtree(self.dirname, ignore_errors=True)
 
     @property
     def num_enter(self) -> int:
@@ -139,39 +215,65 @@ class SharedBarrier:
             num_procs (int): How many processes are sharing this barrier.
         """
         # reinit the numpy array pointing to shared memory. Necessary when spawn is the multiprocessing method used
-        self._arr = np.ndarray(3, buffer=self._shm.buf, dtype=np.int32)
-
-        # Initialize num_exit to the number of processes.
-        with self.lock:
-            if self.num_exit == -1:
-                self.num_exit = num_procs
+        self._arr = np.ndarray(4, buffer=self._shm.buf, dtype=np.int32)
 
-        # If we are the first to arrive, wait for everyone to exit, then set flag to "don't go".
         self.lock.acquire()
-        if not self.num_enter:
-            self.lock.release()
-            while self.num_exit != num_procs:
-                sleep(TICK)
-            self.lock.acquire()
-            self.flag = False
-
-        # Note that we entered.
-        self.num_enter += 1
 
-        # If we are the last to arrive, reset `enter` and `exit`, and set flag to "go".
+        # Initialize num_exit to the number of processes, marking the (nonexistent) previous pass
+        # as fully exited. Folded into the entry critical section, so each pass costs one flock
+        # round-trip on the way in instead of two.
+        if self.num_exit == -1:
+            self.num_exit = num_procs
+            if posix_ipc:
+                self._get_sem('exit').release()
+
+        # If we are the first to arrive, wait for everyone to exit the previous pass, then set
+        # flag to "don't go". The 'exit' semaphore carries exactly one token per pass, so exactly
+        # one process may block on it: we note our entry while still holding the lock, so that
+        # exactly one process per pass can observe a count of zero and become that waiter. The
+        # polling fallback is level-triggered, so there every process that saw a count of zero
+        # waits out the previous pass, entering afterward.
+        if posix_ipc:
+            first = not self.num_enter
+            self.num_enter += 1
+            if first:
+                self.lock.release()
+                self._get_sem('exit').acquire()
+                self.lock.acquire()
+                # The rest of the pass may have arrived and released the barrier while we were
+                # blocked; if so (counters already reset), leave the flag alone.
+                if self.num_exit == num_procs:
+                    self.flag = False
+        else:
+            if not self.num_enter:
+                self.lock.release()
+                self._wait_for(lambda: self.num_exit == num_procs)
+                self.lock.acquire()
+                self.flag = False
+            self.num_enter += 1
+
+        # If we are the last to arrive, reset `enter` and `exit`, and set flag to "go", waking all
+        # the waiters at once.
         if self.num_enter == num_procs:
             self.num_enter = 0
             self.num_exit = 0
             self.flag = True
+            if posix_ipc:
+                for _ in range(num_procs):
+                    self._get_sem('go').release()
         self.lock.release()
 
         # Everybody waits until the flag is set to "go".
-        while not self.flag:
-            sleep(TICK)
+        if posix_ipc:
+            self._get_sem('go').acquire()
+        else:
+            self._wait_for(lambda: self.flag)
 
-        # Note that we exited.
+        # Note that we exited. The last to exit wakes the first arriver of the next pass.
         with self.lock:
             self.num_exit += 1
+            if self.num_exit == num_procs and posix_ipc:
+                self._get_sem('exit').release()
 
 
 def create_shared_memory(name: Optional[str] = None, size: int = 0) -> SharedMemory:
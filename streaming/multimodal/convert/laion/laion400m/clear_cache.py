@@ -0,0 +1,155 @@
+# Copyright 2023 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Clear already-processed LAION-400M shards from the local cache.
+
+Run this alongside download_data.sh and convert_and_upload.py (with --keep_parquet 1 and/or
+--keep_mds 1) to keep local disk usage bounded without blocking either of them.
+"""
+
+import os
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from typing import List, Set, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+
+    Returns:
+        Namespace: Command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument('--local',
+                      type=str,
+                      required=True,
+                      help='Local directory containing downloaded and converted shards.')
+    args.add_argument('--clear_parquet',
+                      type=int,
+                      default=1,
+                      help='Whether to clear the parquet shards of completed shards.')
+    args.add_argument('--clear_mds',
+                      type=int,
+                      default=1,
+                      help='Whether to clear the MDS shards of completed shards.')
+    args.add_argument('--poll_interval',
+                      type=float,
+                      default=30,
+                      help='Interval between polling for newly completed shards to clear.')
+    args.add_argument('--max_workers',
+                      type=int,
+                      default=32,
+                      help='Number of threads to delete files with (unlink releases the GIL).')
+    return args.parse_args()
+
+
+def find_completed_shards(local: str, cleared: Set[str]) -> Tuple[List[str], List[str]]:
+    """Find cached files belonging to shards that are already done.
+
+    Uses a single ``os.scandir`` pass (no per-entry stat calls) to partition dirents, then joins
+    the cached shards against the set of done markers. For MDS shards, only the shard data file
+    is deletable: the `{idx}.mds/` directory and its `index.json` sub-index must survive, because
+    `collect_and_upload_index` reads every sub-index to build the merged index at the end of the
+    run. Since the directories stick around, already-cleared MDS shards are remembered in
+    ``cleared`` so they are not rescrubbed every poll.
+
+    Args:
+        local (str): Local directory containing shards.
+        cleared (Set[str]): Indexes of MDS shards already cleared, updated in place.
+
+    Returns:
+        Tuple[List[str], List[str]]: Deletable parquet files, and deletable MDS shard files.
+    """
+    done = set()
+    parquets = set()
+    mdses = set()
+    for entry in os.scandir(local):
+        name = entry.name
+        if name.endswith('.done'):
+            done.add(name.split('.')[0])
+        elif name.endswith('.parquet'):
+            parquets.add(name.split('.')[0])
+        elif name.endswith('.mds'):
+            mdses.add(name.split('.')[0])
+    files = [os.path.join(local, f'{idx}.parquet') for idx in sorted(parquets & done)]
+    new_mdses = (mdses & done) - cleared
+    shard_files = [
+        os.path.join(local, f'{idx}.mds', 'shard.00000.mds') for idx in sorted(new_mdses)
+    ]
+    cleared.update(new_mdses)
+    return files, shard_files
+
+
+def remove_quietly(filename: str) -> None:
+    """Remove a file, tolerating its absence.
+
+    The converter's own --keep_parquet 0 / --keep_mds 0 cleanup may race us to the same file.
+
+    Args:
+        filename (str): File to remove.
+    """
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def clear_shards(args: Namespace, cleared: Set[str]) -> bool:
+    """Clear any newly completed shards.
+
+    Args:
+        args (Namespace): Command-line arguments.
+        cleared (Set[str]): Indexes of MDS shards already cleared, updated in place.
+
+    Returns:
+        bool: Whether shard downloading is done.
+    """
+    files, shard_files = find_completed_shards(args.local, cleared)
+    if not args.clear_parquet:
+        files = []
+    if not args.clear_mds:
+        shard_files = []
+    if files or shard_files:
+        # Fan deletion out across threads so the unlink() syscalls overlap.
+        with ThreadPoolExecutor(max_workers=args.max_workers) as pool:
+            list(pool.map(remove_quietly, files))
+            list(pool.map(remove_quietly, shard_files))
+        print(f'Cleared {len(files)} parquet shards and {len(shard_files)} MDS shards.')
+
+    # Check for the "done" marker.
+    filename = os.path.join(args.local, 'done')
+    return os.path.exists(filename)
+
+
+def main(args: Namespace) -> None:
+    """Clear completed shards as they are marked done.
+
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    watcher = None
+    if inotify_simple:
+        watcher = inotify_simple.INotify()
+        watcher.add_watch(args.local,
+                          inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO)
+    cleared: Set[str] = set()
+    while True:
+        is_done = clear_shards(args, cleared)
+        if is_done:
+            break
+        if watcher:
+            # Wake as soon as something new lands in the cache, instead of sleeping out a fixed
+            # interval while shards pile up on disk.
+            watcher.read(timeout=int(args.poll_interval * 1000))
+        else:
+            sleep(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -5,15 +5,30 @@
 
 import json
 import os
+import urllib.parse
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
 from time import sleep, time
-from typing import Iterator, List, Optional, Union
+from typing import Callable, Iterator, List, Set
 
-import numpy as np
+import pyarrow as pa
+from pyarrow import compute as pc
 from pyarrow import parquet as pq
 
 from streaming import MDSWriter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
 
 def parse_args() -> Namespace:
     """Parse command-line arguments.
@@ -46,6 +61,10 @@ def parse_args() -> Namespace:
                       type=float,
                       default=30,
                       help='Interval between polling for newly downloaded shards to process.')
+    args.add_argument('--num_procs',
+                      type=int,
+                      default=os.cpu_count(),
+                      help='Number of processes to convert and upload shards with.')
     return args.parse_args()
 
 
@@ -58,64 +77,130 @@ def each_downloaded_shard(local: str) -> Iterator[int]:
     Returns:
         Iterator[int]: Each downloaded shard ID.
     """
-    basenames = set(os.listdir(local))
-    count = len(list(filter(lambda s: s.endswith('_stats.json'), basenames)))
-    for idx in range(count):
-        stats_filename = os.path.join(local, f'{idx:05}_stats.json')
-        if not os.path.exists(stats_filename):
+    # One scandir pass collects the stats files (no per-shard stat calls); contiguity is then
+    # checked against the collected set.
+    idxs = set()
+    for entry in os.scandir(local):
+        if entry.name.endswith('_stats.json'):
+            idxs.add(int(entry.name.split('_')[0]))
+    for idx in range(len(idxs)):
+        if idx not in idxs:
             raise RuntimeError('Stats file is missing.')
         yield idx
 
 
-def get_int(x: Union[float, int]) -> int:
-    """Get an int field from pandas.
+def filter_pending_shards(local: str, done: Set[int]) -> List[int]:
+    """Find downloaded shards that are not already done, in one directory pass.
+
+    Uses a single ``os.scandir`` pass (no per-shard stat calls) to partition dirents into stats
+    files and done markers, then takes the set difference. ``done`` is memoized across poll
+    cycles (done markers are append-only), so it only ever grows.
 
     Args:
-        x (Union[float, int]): The pandas field.
+        local (str): Local directory containing shards.
+        done (Set[int]): Shard IDs already known to be done, updated in place.
 
     Returns:
-        int: The normalized field.
+        List[int]: Pending shard IDs, in order.
     """
-    if np.isnan(x):
-        return 0
-    else:
-        return int(x)
+    stats = set()
+    for entry in os.scandir(local):
+        name = entry.name
+        if name.endswith('_stats.json'):
+            stats.add(int(name.split('_')[0]))
+        elif name.endswith('.done'):
+            done.add(int(name.split('.')[0]))
+    return sorted(stats - done)
+
+
+def normalize_int(col: pa.Array) -> pa.Array:
+    """Normalize an int column from Arrow (nulls and NaNs become 0).
+
+    Args:
+        col (pa.Array): The Arrow column.
+
+    Returns:
+        pa.Array: The normalized column.
+    """
+    col = pc.fill_null(col, 0)
+    if pa.types.is_floating(col.type):
+        col = pc.if_else(pc.is_nan(col), pa.scalar(0, col.type), col)
+    return pc.cast(col, pa.int32(), safe=False)
 
 
-def get_float(x: float) -> float:
-    """Get a float field from pandas.
+def normalize_float(col: pa.Array) -> pa.Array:
+    """Normalize a float column from Arrow (nulls become NaN).
 
     Args:
-        x (float): The pandas field.
+        col (pa.Array): The Arrow column.
 
     Returns:
-        float: The normalized field.
+        pa.Array: The normalized column.
     """
-    return x
+    return pc.fill_null(col, float('nan'))
 
 
-def get_bytes(x: Optional[bytes]) -> bytes:
-    """Get a bytes field from pandas.
+def normalize_bytes(col: pa.Array) -> pa.Array:
+    """Normalize a bytes column from Arrow (nulls become b'').
 
     Args:
-        x (bytes, optional): The pandas field.
+        col (pa.Array): The Arrow column.
 
     Returns:
-        float: The normalized field.
+        pa.Array: The normalized column.
     """
-    return x or b''
+    return pc.fill_null(col, b'')
 
 
-def get_str(x: Optional[str]) -> str:
-    """Get a str field from pandas.
+def normalize_str(col: pa.Array) -> pa.Array:
+    """Normalize a str column from Arrow (nulls become '').
 
     Args:
-        x (str, optional): The pandas field.
+        col (pa.Array): The Arrow column.
+
+    Returns:
+        pa.Array: The normalized column.
+    """
+    return pc.fill_null(col, '')
+
+
+# Mapping of MDS sample field to parquet column name and columnar normalizer.
+FIELDS = {
+    'nsfw': ('NSFW', normalize_str),
+    'similarity': ('similarity', normalize_float),
+    'license': ('LICENSE', normalize_str),
+    'caption': ('caption', normalize_str),
+    'url': ('url', normalize_str),
+    'key': ('key', normalize_str),
+    'status': ('status', normalize_str),
+    'error_message': ('error_message', normalize_str),
+    'width': ('width', normalize_int),
+    'height': ('height', normalize_int),
+    'original_width': ('original_width', normalize_int),
+    'original_height': ('original_height', normalize_int),
+    'exif': ('exif', normalize_str),
+    'jpg': ('jpg', normalize_bytes),
+}
+
+
+def compile_sample_builder() -> Callable[[tuple], dict]:
+    """Compile a function that builds a sample dict from a row tuple.
+
+    Generated once for the fixed schema, this inlines the field names as dict-display constants,
+    so building a sample is a single call instead of a per-row dict(zip(...)) with its key
+    iteration and hashing.
 
     Returns:
-        str: The normalized field.
+        Callable[[tuple], dict]: Function from row tuple to sample dict.
     """
-    return x or ''
+    items = ', '.join(f'{key!r}: row[{i}]' for i, key in enumerate(FIELDS))
+    code = f'def build_sample(row): return {{{items}}}'
+    namespace: dict = {}
+    exec(code, namespace)
+    return namespace['build_sample']
+
+
+build_sample = compile_sample_builder()
 
 
 def convert(parquet_filename: str, mds_dirname: str, hashes: List[str]) -> None:
@@ -146,28 +231,23 @@ def convert(parquet_filename: str, mds_dirname: str, hashes: List[str]) -> None:
     size_limit = None  # Put everything in one shard (1:1 mapping of parquet to MDS shards).
 
     with MDSWriter(mds_dirname, columns, compression, hashes, size_limit) as out:
-        table = pq.read_table(parquet_filename)
-        nr = table.num_rows
-        table = table.to_pandas()
-        for i in range(nr):
-            x = table.iloc[i]
-            sample = {
-                'nsfw': get_str(x['NSFW']),
-                'similarity': get_float(x['similarity']),
-                'license': get_str(x['LICENSE']),
-                'caption': get_str(x['caption']),
-                'url': get_str(x['url']),
-                'key': get_str(x['key']),
-                'status': get_str(x['status']),
-                'error_message': get_str(x['error_message']),
-                'width': get_int(x['width']),
-                'height': get_int(x['height']),
-                'original_width': get_int(x['original_width']),
-                'original_height': get_int(x['original_height']),
-                'exif': get_str(x['exif']),
-                'jpg': get_bytes(x['jpg']),
-            }
-            out.write(sample)
+        names = [name for name, _ in FIELDS.values()]
+        # Stream the parquet shard a batch at a time instead of materializing the entire table in
+        # memory before the row loop starts, keeping the working set constant.
+        parquet = pq.ParquetFile(parquet_filename)
+        for batch in parquet.iter_batches(batch_size=4096, columns=names):
+            # Normalize each column with one Arrow compute kernel, then pull it out of Arrow once
+            # (one bulk C-level conversion per column), instead of calling a Python normalizer on
+            # every field of every row.
+            by_name = dict(zip(batch.schema.names, batch.columns))
+            cols = [normalize(by_name[name]).to_pylist() for name, normalize in FIELDS.values()]
+            for row in zip(*cols):
+                out.write(build_sample(row))
+
+
+# Per-process S3 client, created on first upload so each pool worker reuses one TLS connection
+# pool instead of paying a fresh handshake (or a CLI subprocess) per shard.
+_s3_client = None
 
 
 def upload(local: str, remote: str) -> None:
@@ -175,83 +255,124 @@ def upload(local: str, remote: str) -> None:
 
     Args:
         local (str): Path on local filesystem.
-        remote (str): Path on remote filesystem.
+        remote (str): Path on remote filesystem (S3).
     """
-    local = local.replace(' ', '\\ ')
-    remote = remote.replace(' ', '\\ ')
-    cmd = f'aws s3 cp {local} {remote}'
-    if os.system(cmd):
-        raise RuntimeError(f'Download failed: {cmd}.')
+    import boto3
 
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
 
-def convert_and_upload_shards(args: Namespace) -> bool:
-    """Process any newly downloaded shards.
+    obj = urllib.parse.urlparse(remote)
+    if obj.scheme != 's3':
+        raise ValueError(f'Expected obj.scheme to be "s3", got {obj.scheme} for remote={remote}')
+    _s3_client.upload_file(local, obj.netloc, obj.path.lstrip('/'))
+
+
+def process_shard(args: Namespace, idx: int) -> None:
+    """Convert (if needed), upload, and mark done a single downloaded shard.
+
+    Args:
+        args (Namespace): Command-line arguments.
+        idx (int): Shard ID.
+    """
+    hashes = args.hashes.split(',') if args.hashes else []
+
+    # The shard is not marked done, so possibly convert and definitely upload it.
+    parquet_filename = os.path.join(args.local, f'{idx:05}.parquet')
+    mds_dirname = os.path.join(args.local, f'{idx:05}.mds')
+    mds_shard_filename = os.path.join(mds_dirname, 'shard.00000.mds')
+    mds_index_filename = os.path.join(mds_dirname, 'index.json')
+    remote_shard_filename = os.path.join(args.remote, f'shard.{idx:05}.mds')
+    if os.path.exists(mds_dirname):
+        if not os.path.exists(mds_shard_filename):
+            raise RuntimeError(f'MDS shard file is missing: {mds_shard_filename}.')
+        if not os.path.exists(mds_index_filename):
+            raise RuntimeError(f'MDS index file is missing: {mds_index_filename}.')
+    else:
+        print(f'Shard {idx:05}: converting...')
+        convert(parquet_filename, mds_dirname, hashes)
+    print(f'Shard {idx:05}: uploading...')
+    upload(mds_shard_filename, remote_shard_filename)
+    # Write the done marker atomically (write a temp file, then rename), so a crash mid-write
+    # can never leave a partial marker that a watcher would take as "shard finished".
+    done_filename = os.path.join(args.local, f'{idx:05}.done')
+    tmp_filename = done_filename + '.tmp'
+    with open(tmp_filename, 'w') as out:
+        out.write('')
+    os.replace(tmp_filename, done_filename)
+
+    # Clean up after ourselves to save local storage.
+    if not args.keep_parquet:
+        os.remove(parquet_filename)
+    if not args.keep_mds:
+        os.remove(mds_shard_filename)
+    print(f'Shard {idx:05}: done')
+
+
+def convert_and_upload_shards(args: Namespace, idxs: List[int]) -> bool:
+    """Process the given newly downloaded shards.
 
     Args:
         args (Namespace): Command-line arguments.
+        idxs (List[int]): Pending shard IDs.
 
     Returns:
         bool: Whether shard downloading is done.
     """
-    hashes = args.hashes.split(',') if args.hashes else []
-    for idx in each_downloaded_shard(args.local):
-        # If the shard is already done, skip it.
-        done_filename = os.path.join(args.local, f'{idx:05}.done')
-        if os.path.exists(done_filename):
-            print(f'Shard {idx:05}: done')
-            continue
-
-        # The shard is not marked done, so possibly convert and definitely upload it.
-        parquet_filename = os.path.join(args.local, f'{idx:05}.parquet')
-        mds_dirname = os.path.join(args.local, f'{idx:05}.mds')
-        mds_shard_filename = os.path.join(mds_dirname, 'shard.00000.mds')
-        mds_index_filename = os.path.join(mds_dirname, 'index.json')
-        remote_shard_filename = os.path.join(args.remote, f'shard.{idx:05}.mds')
-        if os.path.exists(mds_dirname):
-            if not os.path.exists(mds_shard_filename):
-                raise RuntimeError(f'MDS shard file is missing: {mds_shard_filename}.')
-            if not os.path.exists(mds_index_filename):
-                raise RuntimeError(f'MDS index file is missing: {mds_index_filename}.')
-        else:
-            print(f'Shard {idx:05}: converting...')
-            convert(parquet_filename, mds_dirname, hashes)
-        print(f'Shard {idx:05}: uploading...')
-        upload(mds_shard_filename, remote_shard_filename)
-        with open(done_filename, 'w') as out:
-            out.write('')
-
-        # Clean up after ourselves to save local storage.
-        if not args.keep_parquet:
-            os.remove(parquet_filename)
-        if not args.keep_mds:
-            os.remove(mds_shard_filename)
-        print(f'Shard {idx:05}: done')
+    # Fan shard processing out across processes. Each shard gets its own MDS dirname and writer
+    # (1:1 mapping of parquet to MDS shards), so shards are completely independent of each other.
+    if idxs:
+        with Pool(args.num_procs) as pool:
+            for _ in pool.imap_unordered(partial(process_shard, args), idxs):
+                pass
 
     # Check for the "done" marker.
     filename = os.path.join(args.local, 'done')
     return os.path.exists(filename)
 
 
+def load_sub_index(sub_index_filename: str) -> dict:
+    """Load the info of the single MDS shard listed in a sub-index file.
+
+    Args:
+        sub_index_filename (str): Filename of the sub-index.
+
+    Returns:
+        dict: The shard info.
+    """
+    with open(sub_index_filename, 'rb') as f:
+        data = f.read()
+    obj = orjson.loads(data) if orjson else json.loads(data)
+    info, = obj['shards']
+    return info
+
+
 def collect_and_upload_index(args: Namespace) -> None:
     """Finally, collect and upload the index.
 
     Args:
         args (Namespace): Command-line arguments.
     """
-    infos = []
-    for idx in each_downloaded_shard(args.local):
-        sub_index_filename = os.path.join(args.local, f'{idx:05}.mds', 'index.json')
-        obj = json.load(open(sub_index_filename))
-        info, = obj['shards']
-        infos.append(info)
+    sub_index_filenames = [
+        os.path.join(args.local, f'{idx:05}.mds', 'index.json')
+        for idx in each_downloaded_shard(args.local)
+    ]
+
+    # Parse sub-indexes on a thread pool (file reads release the GIL); map() preserves shard
+    # order.
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        infos = list(pool.map(load_sub_index, sub_index_filenames))
 
     obj = {
         'version': 2,
         'shards': infos,
     }
     local = os.path.join(args.local, 'index.json')
-    with open(local, 'w') as out:
-        json.dump(obj, out)
+    # Encode straight to bytes (orjson skips the str-then-encode roundtrip of json.dump).
+    data = orjson.dumps(obj) if orjson else json.dumps(obj).encode('utf-8')
+    with open(local, 'wb') as out:
+        out.write(data)
 
     remote = os.path.join(args.remote, 'index.json')
     upload(local, remote)
@@ -263,15 +384,36 @@ def main(args: Namespace) -> None:
     Args:
         args (Namespace): Command-line arguments.
     """
+    # Watch the directory for newly downloaded shards if we can (registered before the initial
+    # scan, so nothing slips between scan and watch), else fall back to polling.
+    watcher = None
+    if inotify_simple:
+        watcher = inotify_simple.INotify()
+        watcher.add_watch(args.local,
+                          inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO)
+
+    done: Set[int] = set()
+    pending = filter_pending_shards(args.local, done)
     while True:
         last_poll = time()
-        is_done = convert_and_upload_shards(args)
+        is_done = convert_and_upload_shards(args, pending)
+        done.update(pending)
         if is_done:
             break
-        now = time()
-        elapsed = now - last_poll
-        if elapsed < args.poll_interval:
-            sleep(args.poll_interval - elapsed)
+        if watcher:
+            # Block until new files land, then rescan. The events are only a wakeup signal: the
+            # watch also fires for every file the converter itself writes, so the kernel event
+            # queue can overflow while we are busy converting (IN_Q_OVERFLOW carries no name),
+            # and shards named only in dropped events would be lost for good. The rescan is a
+            # single scandir pass and also dedupes, so one shard is never processed twice.
+            watcher.read(timeout=int(args.poll_interval * 1000))
+            pending = filter_pending_shards(args.local, done)
+        else:
+            now = time()
+            elapsed = now - last_poll
+            if elapsed < args.poll_interval:
+                sleep(args.poll_interval - elapsed)
+            pending = filter_pending_shards(args.local, done)
 
     collect_and_upload_index(args)
 
@@ -0,0 +1,263 @@
+# Copyright 2023 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Filter a streamed LAION-400M dataset down to its successfully downloaded samples."""
+
+import os
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Full, Queue
+from typing import Any, Dict, List, Optional
+
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from streaming import MDSWriter, StreamingDataset
+from streaming.base.index import get_index_basename
+from streaming.multimodal.convert.laion.laion400m.convert_and_upload import upload
+
+# Sample columns (same schema the converter writes).
+COLUMNS = {
+    'nsfw': 'str',
+    'similarity': 'float64',
+    'license': 'str',
+    'caption': 'str',
+    'url': 'str',
+    'key': 'str',
+    'status': 'str',
+    'error_message': 'str',
+    'width': 'int32',
+    'height': 'int32',
+    'original_width': 'int32',
+    'original_height': 'int32',
+    'exif': 'str',
+    'jpg': 'bytes',
+}
+
+# Fixed column order for flattening samples to tuples on the worker IPC boundary.
+KEYS = tuple(COLUMNS)
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+
+    Returns:
+        Namespace: Command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument('--local',
+                      type=str,
+                      required=True,
+                      help='Local directory to cache the unfiltered shards in.')
+    args.add_argument('--remote',
+                      type=str,
+                      required=True,
+                      help='Remote path to stream the unfiltered dataset from.')
+    args.add_argument('--out',
+                      type=str,
+                      required=True,
+                      help='Local directory to write the filtered MDS shards to. With '
+                      '--remote_out set, this is just a staging area, so it can live on tmpfs '
+                      '(e.g. /dev/shm) to keep shard writes off disk.')
+    args.add_argument('--remote_out',
+                      type=str,
+                      default=None,
+                      help='Remote path (S3) to upload the filtered shards to as they complete, '
+                      'overlapping upload with filtering. If not set, shards stay local.')
+    args.add_argument('--upload_workers',
+                      type=int,
+                      default=8,
+                      help='Number of threads to upload completed shards with.')
+    args.add_argument('--hashes',
+                      type=str,
+                      default='',
+                      help='Hashes for validating the filtered shards, if any.')
+    args.add_argument('--size_limit',
+                      type=int,
+                      default=2 << 30,
+                      help='Shard size limit of the filtered dataset, in bytes. Large shards '
+                      'amortize per-object upload overhead when the output is pushed to cloud '
+                      'storage.')
+    args.add_argument('--predownload',
+                      type=int,
+                      default=100_000,
+                      help='Target number of samples ahead to download the shards of while '
+                      'iterating. Point --local at a tmpfs mount to keep the rolling cache off '
+                      'disk.')
+    args.add_argument('--batch_size',
+                      type=int,
+                      default=512,
+                      help='Batch size to stream the unfiltered dataset with.')
+    args.add_argument('--num_workers',
+                      type=int,
+                      default=64,
+                      help='Number of DataLoader workers to stream and filter with.')
+    return args.parse_args()
+
+
+class StreamingLAIONDataset(StreamingDataset):
+    """A streamed LAION-400M dataset.
+
+    Args:
+        local (str): Local dataset directory where shards are cached.
+        remote (str): Download shards from this remote path.
+        predownload (int): Target number of samples ahead to download the shards of. Each worker
+            runs a background download thread that keeps this far ahead of iteration, so shards
+            arrive before they are needed and are evictable once passed.
+        batch_size (int): Batch size of its DataLoader.
+    """
+
+    def __init__(self, local: str, remote: str, predownload: int, batch_size: int) -> None:
+        super().__init__(local=local,
+                         remote=remote,
+                         shuffle=False,
+                         predownload=predownload,
+                         batch_size=batch_size)
+
+    def __getitem__(self, index: int) -> Optional[Dict[str, Any]]:
+        """Get the sample at the index, or None if its download failed.
+
+        Rejecting failed samples here, at the point of decode, means their jpg payloads are
+        dropped immediately instead of sitting in the batch until collate runs.
+
+        Args:
+            index (int): Sample index.
+
+        Returns:
+            Optional[Dict[str, Any]]: The sample, if it downloaded successfully.
+        """
+        sample = super().__getitem__(index)
+        if sample['status'] != 'success':
+            return None
+        return sample
+
+
+def filter_collate(batch: List[Optional[Dict[str, Any]]]) -> List[tuple]:
+    """Drop failed samples and flatten the keepers to tuples, inside the worker process.
+
+    Running the drop here shards it across the DataLoader workers and keeps failed samples (and
+    their jpg payloads) from ever being pickled across the worker queue. Flattening each keeper
+    to a tuple in KEYS order pickles just the values, instead of a dict whose fourteen key
+    strings would be re-pickled per sample.
+
+    Args:
+        batch (List[Optional[Dict[str, Any]]]): The unfiltered batch.
+
+    Returns:
+        List[tuple]: The samples that downloaded successfully, as value tuples in KEYS order.
+    """
+    return [tuple(sample[key] for key in KEYS) for sample in batch if sample is not None]
+
+
+def write_batches(batches: Queue, out: MDSWriter) -> None:
+    """Drain the batch queue into the writer, on a dedicated thread.
+
+    Decouples pulling batches off the DataLoader from writing them, so the main thread can fetch
+    the next batch while a shard flush is in progress (file I/O releases the GIL). A None batch
+    is the shutdown sentinel. Run via a ThreadPoolExecutor future so that if a write raises, the
+    main loop sees the exception instead of blocking forever on a full queue.
+
+    Args:
+        batches (Queue): Queue of filtered batches to write.
+        out (MDSWriter): Writer of the filtered dataset.
+    """
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        for values in batch:
+            out.write(dict(zip(KEYS, values)))
+
+
+def put_batch(batches: Queue, writing: Future, batch: Optional[List[tuple]]) -> None:
+    """Enqueue a batch for the writer, failing loudly if the writer has died.
+
+    A bare put could block forever on a full queue that nothing is draining, so wait in short
+    timeouts and re-raise the writer's exception the moment its future resolves.
+
+    Args:
+        batches (Queue): Queue of filtered batches to write.
+        writing (Future): The writer's future.
+        batch (Optional[List[tuple]]): The batch, or None to shut the writer down.
+    """
+    while True:
+        if writing.done():
+            writing.result()
+            return
+        try:
+            batches.put(batch, timeout=1)
+            return
+        except Full:
+            pass
+
+
+def upload_basename(args: Namespace, basename: str, delete: bool = False) -> None:
+    """Upload one file of the filtered dataset to the remote output directory.
+
+    Args:
+        args (Namespace): Command-line arguments.
+        basename (str): The file's basename.
+        delete (bool): Whether to delete the local copy once the upload succeeds, keeping the
+            staging directory (possibly tmpfs) from filling up. Defaults to ``False``.
+    """
+    local = os.path.join(args.out, basename)
+    upload(local, os.path.join(args.remote_out, basename))
+    if delete:
+        os.remove(local)
+
+
+def main(args: Namespace) -> None:
+    """Stream, filter, and rewrite the dataset.
+
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    hashes = args.hashes.split(',') if args.hashes else []
+    dataset = StreamingLAIONDataset(args.local, args.remote, args.predownload, args.batch_size)
+    loader = DataLoader(dataset,
+                        batch_size=args.batch_size,
+                        num_workers=args.num_workers,
+                        prefetch_factor=8,
+                        persistent_workers=True,
+                        pin_memory=False,
+                        multiprocessing_context='forkserver',
+                        collate_fn=filter_collate)
+    pool = ThreadPoolExecutor(max_workers=args.upload_workers) if args.remote_out else None
+    futures = []
+    num_started = 0
+    batches = Queue(maxsize=8)
+    writer_pool = ThreadPoolExecutor(max_workers=1)
+    with MDSWriter(args.out, COLUMNS, None, hashes, args.size_limit) as out:
+        writing = writer_pool.submit(write_batches, batches, out)
+        try:
+            # Throttle the progress bar: redraw at most every couple seconds, not per batch.
+            for batch in tqdm(loader, mininterval=2.0, miniters=100, smoothing=0):
+                put_batch(batches, writing, batch)
+                # Start uploading any shards that just completed, overlapping upload with
+                # filtering.
+                if pool:
+                    while num_started < len(out.shards):
+                        info = out.shards[num_started]
+                        basename = (info['zip_data'] or info['raw_data'])['basename']
+                        futures.append(pool.submit(upload_basename, args, basename, True))
+                        num_started += 1
+        finally:
+            # Always shut the writer down, even if the loader raised: a still-live writer thread
+            # would race the finish() below on the shard cache, and as a non-daemon thread would
+            # hang interpreter exit.
+            put_batch(batches, writing, None)
+            writing.result()
+    writer_pool.shutdown()
+    if pool:
+        # Exiting the with block flushed the final partial shard and wrote the index.
+        for info in out.shards[num_started:]:
+            basename = (info['zip_data'] or info['raw_data'])['basename']
+            futures.append(pool.submit(upload_basename, args, basename, True))
+        for future in futures:
+            future.result()
+        upload_basename(args, get_index_basename())
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main(parse_args())
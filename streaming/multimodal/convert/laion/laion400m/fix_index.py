@@ -0,0 +1,155 @@
+# Copyright 2023 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Rebuild a LAION-400M index.json from already-uploaded MDS shards.
+
+Each shard entry is reconstructed from two HTTP range requests against the shard header, so no
+shard body is ever downloaded. Shard hashes cannot be recomputed without the bodies, so the
+rebuilt entries carry empty hash dicts (pass validate_hash=None when reading such a dataset).
+"""
+
+import json
+import os
+import urllib.parse
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from streaming.multimodal.convert.laion.laion400m.convert_and_upload import upload
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Per-process S3 client (boto3 clients are thread-safe), created on first use.
+_s3_client = None
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+
+    Returns:
+        Namespace: Command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument('--remote',
+                      type=str,
+                      required=True,
+                      help='Remote directory (S3) containing the uploaded MDS shards.')
+    args.add_argument('--local',
+                      type=str,
+                      required=True,
+                      help='Local filename to write the rebuilt index.json to before uploading.')
+    args.add_argument('--max_workers',
+                      type=int,
+                      default=64,
+                      help='Number of threads to fetch shard headers with (network-bound).')
+    return args.parse_args()
+
+
+def get_client():
+    """Get the shared S3 client, creating it on first use.
+
+    Returns:
+        botocore.client.BaseClient: The S3 client.
+    """
+    import boto3
+
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+def list_shards(remote: str) -> List[str]:
+    """List the basenames of the MDS shards under the remote directory.
+
+    Args:
+        remote (str): Remote directory (S3).
+
+    Returns:
+        List[str]: Each shard basename, in order.
+    """
+    obj = urllib.parse.urlparse(remote)
+    if obj.scheme != 's3':
+        raise ValueError(f'Expected obj.scheme to be "s3", got {obj.scheme} for remote={remote}')
+    prefix = obj.path.strip('/') + '/'
+    basenames = []
+    paginator = get_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=obj.netloc, Prefix=prefix):
+        for item in page.get('Contents', []):
+            basename = os.path.basename(item['Key'])
+            if basename.startswith('shard.') and basename.endswith('.mds'):
+                basenames.append(basename)
+    return sorted(basenames)
+
+
+def fetch_shard_info(remote: str) -> dict:
+    """Build one shard's index entry from range requests against its header.
+
+    An MDS joint shard is laid out as a uint32 sample count, uint32 offsets[samples + 1], the
+    JSON shard config, then the sample data. offsets[0] is where the config ends and offsets[-1]
+    is the total file size, so the first 8 bytes locate the config and the config plus a HEAD
+    request yield the whole index entry.
+
+    Args:
+        remote (str): Remote shard filename (S3).
+
+    Returns:
+        dict: The shard info.
+    """
+    obj = urllib.parse.urlparse(remote)
+    bucket = obj.netloc
+    key = obj.path.lstrip('/')
+    client = get_client()
+
+    head = client.get_object(Bucket=bucket, Key=key, Range='bytes=0-7')['Body'].read()
+    samples = int.from_bytes(head[:4], 'little')
+    config_end = int.from_bytes(head[4:8], 'little')
+    config_begin = 4 + (samples + 1) * 4
+    data = client.get_object(Bucket=bucket,
+                             Key=key,
+                             Range=f'bytes={config_begin}-{config_end - 1}')['Body'].read()
+    info = orjson.loads(data) if orjson else json.loads(data)
+
+    size = client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    info.update({
+        'samples': samples,
+        'raw_data': {
+            'basename': os.path.basename(key),
+            'bytes': size,
+            'hashes': {},
+        },
+        'zip_data': None,
+    })
+    return info
+
+
+def main(args: Namespace) -> None:
+    """Rebuild and upload the index.
+
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    remotes = [os.path.join(args.remote, basename) for basename in list_shards(args.remote)]
+
+    # Fetch shard headers on a thread pool (pure socket I/O); map() preserves shard order.
+    with ThreadPoolExecutor(max_workers=args.max_workers) as pool:
+        infos = list(pool.map(fetch_shard_info, remotes))
+
+    obj = {
+        'version': 2,
+        'shards': infos,
+    }
+    # Encode straight to bytes (orjson skips the str-then-encode roundtrip of json.dump).
+    data = orjson.dumps(obj) if orjson else json.dumps(obj).encode('utf-8')
+    with open(args.local, 'wb') as out:
+        out.write(data)
+
+    remote = os.path.join(args.remote, 'index.json')
+    upload(args.local, remote)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -13,6 +13,11 @@ import pytest
 
 from streaming.base.shared import SharedBarrier
 
+try:
+    import posix_ipc
+except ImportError:
+    posix_ipc = None
+
 
 class TestSharedBarrier:
 
@@ -23,7 +28,7 @@ class TestSharedBarrier:
         assert barrier.filelock_path == filelock_path
         assert barrier.shm_path == shm_path
         assert isinstance(barrier._arr, np.ndarray)
-        assert barrier._arr.shape == (3,)
+        assert barrier._arr.shape == (4,)
         assert barrier.num_enter == 0
         assert barrier.num_exit == -1
         assert barrier.flag is True
@@ -70,3 +75,38 @@ class TestSharedBarrier:
             expected_log_message[i + (2 * num_process)] = f'passed barrier again: Process-\\d+'
 
         assert re.fullmatch(' '.join(expected_log_message), ' '.join(shared_list))
+
+    def run_passes(self, num_process: int, num_passes: int, barrier: Any,
+                   shared_list: ListProxy):
+        for i in range(num_passes):
+            sleep(random() / 100)
+            barrier(num_process)
+            shared_list.append(i)
+
+    @pytest.mark.skipif(posix_ipc is None, reason='posix_ipc is not installed')
+    @pytest.mark.parametrize('num_process', [2, 3])
+    def test_barrier_semaphore_contention(self, num_process: int):
+        num_passes = 50
+        mp.set_start_method('fork', force=True)
+        manager = mp.Manager()
+        shared_list = manager.list()
+        barrier = SharedBarrier('/tmp/dir/file_path', 'barrier_shm_path', True)
+        processes = [
+            mp.Process(target=self.run_passes,
+                       args=(num_process, num_passes, barrier, shared_list))
+            for _ in range(num_process)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(60)
+        hung = [p for p in processes if p.is_alive()]
+        for p in hung:
+            p.terminate()
+        assert not hung
+
+        # Nobody may log pass i + 1 until everybody has logged pass i.
+        logged = list(shared_list)
+        assert len(logged) == num_process * num_passes
+        for i in range(num_passes):
+            assert logged[i * num_process:(i + 1) * num_process] == [i] * num_process